@@ -4,13 +4,173 @@ import os
 from urllib.parse import quote
 from dotenv import load_dotenv
 import time
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from google.api_core.exceptions import GoogleAPICallError, RetryError
+from google.api_core import retry as retries
 
 load_dotenv()
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 PROCESSOR_ID = os.getenv("PROCESSOR_ID")
+# Optional SQLite full-text index of pdf_text, shared with the webhook
+FTS_INDEX_PATH = os.getenv("FTS_INDEX_PATH")
+FTS_TABLE = "pdf_text_fts"
+# Records that the index was backfilled from every existing pdf_text document
+FTS_STATE_TABLE = "pdf_text_fts_state"
+
+# Small batches committed concurrently keep Firestore busy without
+# serializing on a single large commit
+FIRESTORE_BATCH_SIZE = 50
+FIRESTORE_COMMIT_WORKERS = 10
+FIRESTORE_MAX_IN_FLIGHT = FIRESTORE_COMMIT_WORKERS * 2
+FIRESTORE_COMMIT_ATTEMPTS = 3
+FIRESTORE_COMMIT_RETRY = retries.Retry(
+    predicate=retries.if_transient_error,
+    initial=1.0,
+    maximum=10.0,
+    timeout=60.0
+)
+
+# Concurrent downloads of Document AI output shards
+SHARD_DOWNLOAD_WORKERS = 8
+
+# Listing size used when resolving a file name to a blob
+BLOB_LOOKUP_MAX_RESULTS = 50
+
+# Image batches described and uploaded concurrently per PDF
+IMAGE_WORKERS = 16
+# Images smaller than 64x64 pixels are skipped as icons
+MIN_IMAGE_AREA = 64 * 64
+# Vision accepts at most 16 images per batch_annotate_images call
+VISION_BATCH_SIZE = 16
+# Vision rejects requests over 10 MB of JSON; inline images grow by 4/3 when
+# base64-encoded, so cap the raw bytes per batch well below that
+VISION_BATCH_MAX_BYTES = 7 * 1024 * 1024
+VISION_FEATURES = [
+    vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
+    vision.Feature(type_=vision.Feature.Type.OBJECT_LOCALIZATION)
+]
+
+# Cloud clients are created lazily and shared by every call and worker thread
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def _get_db():
+    return _get_client("firestore", firestore.Client)
+
+def _get_storage_client():
+    return _get_client("storage", storage.Client)
+
+def _get_vision_client():
+    return _get_client("vision", vision.ImageAnnotatorClient)
+
+def _get_docai_client():
+    return _get_client("documentai", documentai.DocumentProcessorServiceClient)
+
+def write_documents(db, collection_name, payloads):
+    """Write payloads to a Firestore collection using concurrent batched commits, returning the new ids"""
+    collection = db.collection(collection_name)
+    in_flight = {}
+    doc_ids = []
+
+    with ThreadPoolExecutor(max_workers=FIRESTORE_COMMIT_WORKERS) as executor:
+        def submit(batch, attempt=1):
+            future = executor.submit(batch.commit, retry=FIRESTORE_COMMIT_RETRY)
+            in_flight[future] = (batch, attempt)
+
+        def reap(max_pending):
+            while len(in_flight) > max_pending:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, attempt = in_flight.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        continue
+                    if attempt >= FIRESTORE_COMMIT_ATTEMPTS:
+                        raise error
+                    print(f" Retrying batch commit to {collection_name} ({attempt}/{FIRESTORE_COMMIT_ATTEMPTS}): {str(error)}")
+                    submit(batch, attempt + 1)
+
+        batch = db.batch()
+        pending = 0
+        for payload in payloads:
+            doc_ref = collection.document()
+            batch.set(doc_ref, payload)
+            doc_ids.append(doc_ref.id)
+            pending += 1
+            if pending >= FIRESTORE_BATCH_SIZE:
+                submit(batch)
+                reap(FIRESTORE_MAX_IN_FLIGHT)
+                batch = db.batch()
+                pending = 0
+
+        if pending:
+            submit(batch)
+        reap(0)
+
+    return doc_ids
+
+def create_text_index(conn):
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(doc_id UNINDEXED, content)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {FTS_STATE_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+
+def index_text_documents(index_path, doc_ids, page_rows):
+    """Append ingested pages to the SQLite FTS5 index searched by the webhook"""
+    with closing(sqlite3.connect(index_path)) as conn, conn:
+        create_text_index(conn)
+        conn.executemany(
+            f"INSERT INTO {FTS_TABLE} (doc_id, content) VALUES (?, ?)",
+            zip(doc_ids, (row["content"] for row in page_rows))
+        )
+
+def backfill_text_index(index_path):
+    """Rebuild the FTS5 index from every pdf_text document and mark it complete"""
+    db = _get_db()
+    with closing(sqlite3.connect(index_path)) as conn, conn:
+        create_text_index(conn)
+        conn.execute(f"DELETE FROM {FTS_TABLE}")
+        conn.executemany(
+            f"INSERT INTO {FTS_TABLE} (doc_id, content) VALUES (?, ?)",
+            (
+                (doc.id, str((doc.to_dict() or {}).get("content", "") or ""))
+                for doc in db.collection("pdf_text").select(["content"]).stream()
+            )
+        )
+        # The webhook only switches text search to the index once this is set
+        conn.execute(
+            f"INSERT OR REPLACE INTO {FTS_STATE_TABLE} (key, value) VALUES ('backfilled_at', ?)",
+            (time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),)
+        )
+        indexed = conn.execute(f"SELECT count(*) FROM {FTS_TABLE}").fetchone()[0]
+
+    print(f" Backfilled {indexed} pages into {index_path}")
+
+def clear_backfill_marker(index_path):
+    """Stop the webhook trusting an index that missed an ingest"""
+    try:
+        with closing(sqlite3.connect(index_path)) as conn, conn:
+            create_text_index(conn)
+            conn.execute(f"DELETE FROM {FTS_STATE_TABLE} WHERE key = 'backfilled_at'")
+        print(f" Cleared the backfill marker on {index_path}; run --backfill-fts to rebuild it")
+    except Exception as e:
+        print(f" Could not clear the backfill marker on {index_path}: {str(e)}")
 
 def get_blob(bucket, file_name):
     """Get blob with multiple filename format attempts"""
@@ -21,19 +181,56 @@ def get_blob(bucket, file_name):
         file_name.replace(" ", "%20")
     ]
 
+    # One listing under the shared prefix replaces up to four exists() probes
+    prefix = os.path.commonprefix(attempts)
+    candidates = {
+        blob.name: blob
+        for blob in bucket.list_blobs(prefix=prefix, max_results=BLOB_LOOKUP_MAX_RESULTS)
+    }
     for attempt in attempts:
-        blob = bucket.blob(attempt)
-        if blob.exists():
-            return blob
+        if attempt in candidates:
+            return candidates[attempt]
+
+    # The listing may have been truncated before reaching the file
+    if len(candidates) >= BLOB_LOOKUP_MAX_RESULTS:
+        for attempt in attempts:
+            blob = bucket.blob(attempt)
+            if blob.exists():
+                return blob
     raise FileNotFoundError(f"File not found in bucket. Tried: {attempts}")
 
+def split_gcs_uri(gcs_uri):
+    """Split a gs://bucket/prefix URI into a bucket name and a directory prefix"""
+    bucket_name, _, prefix = gcs_uri.removeprefix("gs://").partition("/")
+    return bucket_name, prefix.rstrip("/") + "/"
+
+def download_shard(blob, path):
+    """Stream a Document AI output shard to a local file and return its path"""
+    blob.download_to_filename(path)
+    return path
+
+def parse_output_shard(shard_path):
+    """Parse a Document AI output shard into (text, width, height) per page"""
+    with open(shard_path, "rb") as shard_file:
+        doc = documentai.Document.from_json(shard_file.read(), ignore_unknown_fields=True)
+
+    pages = []
+    for page in doc.pages:
+        segment = page.layout.text_anchor.text_segments[0]
+        pages.append((
+            doc.text[segment.start_index:segment.end_index],
+            page.dimension.width,
+            page.dimension.height
+        ))
+    return pages
+
 def process_pdf(bucket_name, file_name):
     """Process PDF with Document AI"""
     print(f" Starting Document AI processing for: {file_name}")
 
-    docai_client = documentai.DocumentProcessorServiceClient()
-    storage_client = storage.Client()
-    db = firestore.Client()
+    docai_client = _get_docai_client()
+    storage_client = _get_storage_client()
+    db = _get_db()
     bucket = storage_client.bucket(bucket_name)
 
     if not bucket.exists():
@@ -70,48 +267,63 @@ def process_pdf(bucket_name, file_name):
         operation.result(timeout=600)
 
         metadata = documentai.BatchProcessMetadata(operation.metadata)
+        output_blobs = []
         for status in metadata.individual_process_statuses:
             if status.status.code != 0:
                 error_msg = f"Document AI Error: {status.status.message}"
                 print(f" {error_msg}")
                 raise RuntimeError(error_msg)
 
-        output_blobs = list(bucket.list_blobs(prefix="processed/"))
+            # Only list this run's output rather than everything under processed/
+            output_bucket, output_prefix = split_gcs_uri(status.output_gcs_destination)
+            output_blobs.extend(storage_client.list_blobs(output_bucket, prefix=output_prefix))
+
         if not output_blobs:
-            raise FileNotFoundError("No output files found in processed/ directory")
+            raise FileNotFoundError("No output files found for this Document AI operation")
 
         total_pages = 0
-        base_name = file_name.replace(".pdf", "")
-
-        for blob in output_blobs:
-            if not blob.name.endswith(".json") or base_name not in blob.name:
-                continue
-
-            print(f" Processing output shard: {blob.name}")
-            doc = documentai.Document.from_json(
-                blob.download_as_bytes(),
-                ignore_unknown_fields=True
+        page_rows = []
+
+        shard_blobs = [blob for blob in output_blobs if blob.name.endswith(".json")]
+
+        # Downloads are network-bound and JSON parsing is CPU-bound, so overlap
+        # them with threads and processes respectively. Shards go through disk so
+        # neither this process nor the pipe to the parsers buffers whole shards.
+        # Spawned workers avoid forking a process that already holds gRPC channels.
+        with tempfile.TemporaryDirectory() as shard_dir, \
+                ThreadPoolExecutor(max_workers=SHARD_DOWNLOAD_WORKERS) as downloads, \
+                ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as parsers:
+            shard_paths = downloads.map(
+                download_shard,
+                shard_blobs,
+                [os.path.join(shard_dir, f"shard-{index}.json") for index in range(len(shard_blobs))]
             )
+            parsed_shards = [parsers.submit(parse_output_shard, path) for path in shard_paths]
 
-            for page in doc.pages:
-                total_pages += 1
-                text_content = doc.text[
-                    page.layout.text_anchor.text_segments[0].start_index:
-                    page.layout.text_anchor.text_segments[0].end_index
-                ]
-
-                db.collection("pdf_text").add({
-                    "source_file": file_name,
-                    "page": total_pages,
-                    "content": text_content,
-                    "dimensions": {
-                        "width": page.dimension.width,
-                        "height": page.dimension.height
-                    },
-                    "processor": PROCESSOR_ID,
-                    "timestamp": firestore.SERVER_TIMESTAMP
-                })
+            for blob, parsed in zip(shard_blobs, parsed_shards):
+                print(f" Processing output shard: {blob.name}")
+                for text_content, width, height in parsed.result():
+                    total_pages += 1
+                    page_rows.append({
+                        "source_file": file_name,
+                        "page": total_pages,
+                        "content": text_content,
+                        "dimensions": {
+                            "width": width,
+                            "height": height
+                        },
+                        "processor": PROCESSOR_ID,
+                        "timestamp": firestore.SERVER_TIMESTAMP
+                    })
 
+        doc_ids = write_documents(db, "pdf_text", page_rows)
+        if FTS_INDEX_PATH:
+            try:
+                index_text_documents(FTS_INDEX_PATH, doc_ids, page_rows)
+            except Exception as e:
+                # The pages are already in Firestore; only the index is behind
+                print(f" FTS indexing failed, pages are stored but missing from {FTS_INDEX_PATH}: {str(e)}")
+                clear_backfill_marker(FTS_INDEX_PATH)
         print(f" Successfully processed {total_pages} pages")
         return True
 
@@ -155,22 +367,8 @@ def extract_images_from_pdf(pdf_path, output_folder):
     
     return images
     
-def analyze_image_with_vision(image_content):
-    """Analyze image using Vision API"""
-    vision_client = vision.ImageAnnotatorClient()
-    image = vision.Image(content=image_content)
-
-    features = [
-        vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION),
-        vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
-        vision.Feature(type_=vision.Feature.Type.OBJECT_LOCALIZATION)
-    ]
-
-    response = vision_client.annotate_image({
-        'image': image,
-        'features': features
-    })
-
+def describe_annotations(response):
+    """Summarize a Vision API annotation response as a short description"""
     description_parts = []
 
     if response.label_annotations:
@@ -189,66 +387,229 @@ def analyze_image_with_vision(image_content):
 
     return " | ".join(description_parts) if description_parts else None
 
-def extract_images(bucket_name, file_name):
-    """Extract images from PDF with Vision API descriptions"""
-    print(f" Starting image extraction for: {file_name}")
+def analyze_images_with_vision(image_contents):
+    """Analyze a batch of images, as grouped by batch_images_for_vision, in one Vision API call"""
+    vision_client = _get_vision_client()
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=content), features=VISION_FEATURES)
+        for content in image_contents
+    ]
 
-    storage_client = storage.Client()
-    db = firestore.Client()
-    bucket = storage_client.bucket(bucket_name)
+    response = vision_client.batch_annotate_images(requests=requests)
 
-    try:
-        blob = get_blob(bucket, file_name)
-        doc = fitz.open(stream=blob.download_as_bytes())
+    descriptions = []
+    for image_response in response.responses:
+        if image_response.error.message:
+            print(f" Vision API error: {image_response.error.message}")
+            descriptions.append(None)
+        else:
+            descriptions.append(describe_annotations(image_response))
+    return descriptions
+
+def analyze_image_with_vision(image_content):
+    """Analyze image using Vision API"""
+    return analyze_images_with_vision([image_content])[0]
+
+def upload_image(bucket, file_name, page_num, img_index, base_image, vision_description):
+    """Upload an extracted image to GCS and build its Firestore row"""
+    image_content = base_image["image"]
+
+    description = vision_description if vision_description else f"Image from {file_name} on page {page_num + 1}"
+
+    image_ext = base_image["ext"]
+    image_name = f"{file_name}_p{page_num}_i{img_index}.{image_ext}"
+    image_blob = bucket.blob(f"extracted_images/{image_name}")
+
+    image_blob.upload_from_string(
+        image_content,
+        content_type=f'image/{image_ext}'
+    )
+
+    # Generate public URL
+    public_url = f"https://storage.googleapis.com/{bucket.name}/{image_blob.name}"
+
+    return {
+        "source_file": file_name,
+        "page": page_num + 1,
+        "image_index": img_index,
+        "image_path": image_blob.name,
+        "public_url": public_url,
+        "description": description,
+        "dimensions": {
+            "width": base_image["width"],
+            "height": base_image["height"]
+        },
+        "format": image_ext,
+        "timestamp": firestore.SERVER_TIMESTAMP
+    }
+
+def upload_image_copies(bucket, file_name, base_image, positions, vision_description):
+    """Upload one distinct image and build a row for every (page, index) it appears at"""
+    # A failed upload falls back to the next copy, so one bad request cannot drop them all
+    uploaded = None
+    for page_num, img_index in positions:
+        try:
+            uploaded = upload_image(bucket, file_name, page_num, img_index, base_image, vision_description)
+            print(f" Processed image {img_index + 1} on page {page_num + 1}")
+            break
+        except Exception as img_error:
+            print(f" Error processing image {img_index} on page {page_num}: {str(img_error)}")
+
+    if uploaded is None:
+        if len(positions) > 1:
+            skipped = ", ".join(f"image {img_index} on page {page_num}" for page_num, img_index in positions)
+            print(f" Skipped every copy of a repeated image: {skipped}")
+        return []
+
+    rows = []
+    for page_num, img_index in positions:
+        if (page_num + 1, img_index) == (uploaded["page"], uploaded["image_index"]):
+            rows.append(uploaded)
+        else:
+            rows.append(dict(uploaded, page=page_num + 1, image_index=img_index))
+            print(f" Reused image {uploaded['image_index'] + 1} from page {uploaded['page']} for image {img_index + 1} on page {page_num + 1}")
+    return rows
+
+def download_to_tempfile(blob):
+    """Stream a blob into a named temporary file, returned open and rewound"""
+    pdf_file = tempfile.NamedTemporaryFile(suffix=".pdf")
+    # Leave chunk_size unset: that keeps a single checksummed streaming GET
+    blob.download_to_file(pdf_file)
+    pdf_file.flush()
+    pdf_file.seek(0)
+    return pdf_file
+
+def count_pdf_pages(pdf_path):
+    """Return the number of pages in a PDF on disk"""
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+def read_pdf_images(pdf_path, first_page, end_page):
+    """Extract every embedded image on pages [first_page, end_page) of a PDF on disk"""
+    doc = fitz.open(pdf_path)
 
-        image_count = 0
-        for page_num in range(len(doc)):
+    try:
+        extracted = []
+        for page_num in range(first_page, end_page):
             page = doc.load_page(page_num)
             images = page.get_images(full=True)
 
             for img_index, img in enumerate(images):
                 try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_content = base_image["image"]
-
-                    vision_description = analyze_image_with_vision(image_content)
-                    description = vision_description if vision_description else f"Image from {file_name} on page {page_num + 1}"
+                    base_image = doc.extract_image(img[0])
+                    # Icons and spacers are not worth a Vision call or an upload
+                    if base_image["width"] * base_image["height"] < MIN_IMAGE_AREA:
+                        continue
+                    extracted.append((page_num, img_index, base_image))
+                except Exception as img_error:
+                    print(f" Error processing image {img_index} on page {page_num}: {str(img_error)}")
 
-                    image_ext = base_image["ext"]
-                    image_name = f"{file_name}_p{page_num}_i{img_index}.{image_ext}"
-                    image_blob = bucket.blob(f"extracted_images/{image_name}")
+            # PyMuPDF keeps decoded fonts/images cached; empty the store per page
+            # so a long-lived worker does not grow without bound
+            del page
+            fitz.TOOLS.store_shrink(100)
+
+        return extracted
+    finally:
+        doc.close()
+
+def batch_images_for_vision(extracted):
+    """Group extracted images into batches within Vision's count and request size limits"""
+    batch = []
+    batch_bytes = 0
+    for item in extracted:
+        image_bytes = len(item[2]["image"])
+        if batch and (len(batch) >= VISION_BATCH_SIZE or batch_bytes + image_bytes > VISION_BATCH_MAX_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += image_bytes
+    if batch:
+        yield batch
+
+def describe_image_batch(extracted_batch):
+    """Describe a batch with one Vision call, falling back to one call per image"""
+    image_contents = [base_image["image"] for _, _, base_image in extracted_batch]
+    try:
+        return analyze_images_with_vision(image_contents)
+    except Exception as batch_error:
+        print(f" Batch Vision call failed, describing images individually: {str(batch_error)}")
+
+    descriptions = []
+    for (page_num, img_index, _), image_content in zip(extracted_batch, image_contents):
+        try:
+            descriptions.append(analyze_image_with_vision(image_content))
+        except Exception as img_error:
+            print(f" Vision API error for image {img_index} on page {page_num}: {str(img_error)}")
+            descriptions.append(None)
+    return descriptions
 
-                    image_blob.upload_from_string(
-                        image_content,
-                        content_type=f'image/{image_ext}'
-                    )
+def extract_images(bucket_name, file_name):
+    """Extract images from PDF with Vision API descriptions"""
+    print(f" Starting image extraction for: {file_name}")
 
-                    # Generate public URL
-                    public_url = f"https://storage.googleapis.com/{bucket_name}/{image_blob.name}"
+    storage_client = _get_storage_client()
+    db = _get_db()
+    bucket = storage_client.bucket(bucket_name)
 
-                    db.collection("pdf_images_new").add({
-                        "source_file": file_name,
-                        "page": page_num + 1,
-                        "image_index": img_index,
-                        "image_path": image_blob.name,
-                        "public_url": public_url,
-                        "description": description,
-                        "dimensions": {
-                            "width": base_image["width"],
-                            "height": base_image["height"]
-                        },
-                        "format": image_ext,
-                        "timestamp": firestore.SERVER_TIMESTAMP
-                    })
+    try:
+        blob = get_blob(bucket, file_name)
+        with download_to_tempfile(blob) as pdf_file:
+            page_count = count_pdf_pages(pdf_file.name)
+
+            # Extraction holds the GIL, so split the pages across processes that
+            # each open their own copy of the PDF from the temp file
+            workers = os.cpu_count() or 1
+            shard_size = max(1, -(-page_count // workers))
+            extracted = []
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as extractors:
+                shards = [
+                    extractors.submit(read_pdf_images, pdf_file.name, start, min(start + shard_size, page_count))
+                    for start in range(0, page_count, shard_size)
+                ]
+                for shard in shards:
+                    extracted.extend(shard.result())
+
+        # Logos and headers repeat across pages; describe and upload each distinct image once
+        unique_images = {}
+        for page_num, img_index, base_image in extracted:
+            image_key = hashlib.blake2b(base_image["image"], digest_size=16).digest()
+            unique_images.setdefault(image_key, (base_image, []))[1].append((page_num, img_index))
+        to_describe = [
+            (positions[0][0], positions[0][1], base_image)
+            for base_image, positions in unique_images.values()
+        ]
+        positions_by_image = [positions for _, positions in unique_images.values()]
+
+        # Vision and GCS calls are network-bound: describe in batches, then give
+        # every distinct image its own upload task so uploads overlap across images
+        image_rows = []
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+            described = [
+                (extracted_batch, executor.submit(describe_image_batch, extracted_batch))
+                for extracted_batch in batch_images_for_vision(to_describe)
+            ]
+
+            uploads = []
+            remaining_positions = iter(positions_by_image)
+            for extracted_batch, future in described:
+                try:
+                    descriptions = future.result()
+                except Exception as batch_error:
+                    print(f" Error describing image batch: {str(batch_error)}")
+                    descriptions = [None] * len(extracted_batch)
 
-                    image_count += 1
-                    print(f" Processed image {img_index + 1} on page {page_num + 1}")
+                for (_, _, base_image), vision_description in zip(extracted_batch, descriptions):
+                    uploads.append(executor.submit(
+                        upload_image_copies, bucket, file_name, base_image, next(remaining_positions), vision_description
+                    ))
 
-                except Exception as img_error:
-                    print(f" Error processing image {img_index} on page {page_num}: {str(img_error)}")
+            for future in uploads:
+                image_rows.extend(future.result())
 
-        print(f" Extracted {image_count} images with descriptions from {len(doc)} pages")
+        write_documents(db, "pdf_images_new", image_rows)
+        print(f" Extracted {len(image_rows)} images with descriptions from {page_count} pages")
         return True
 
     except Exception as e:
@@ -263,12 +624,10 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--bucket",
-        required=True,
         help="GCS bucket name"
     )
     parser.add_argument(
         "--file",
-        required=True,
         help="PDF file name in bucket (can contain spaces)"
     )
     parser.add_argument(
@@ -276,10 +635,25 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable image extraction"
     )
+    parser.add_argument(
+        "--backfill-fts",
+        action="store_true",
+        help="Rebuild the FTS_INDEX_PATH index from all existing pdf_text documents"
+    )
 
     args = parser.parse_args()
 
     start_time = time.time()
+    if args.backfill_fts:
+        if not FTS_INDEX_PATH:
+            parser.error("--backfill-fts requires FTS_INDEX_PATH to be set")
+        backfill_text_index(FTS_INDEX_PATH)
+        if not args.file:
+            parser.exit()
+
+    if not args.bucket or not args.file:
+        parser.error("--bucket and --file are required")
+
     process_success = process_pdf(args.bucket, args.file)
 
     if args.extract_images and process_success:
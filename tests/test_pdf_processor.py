@@ -0,0 +1,282 @@
+import importlib
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+
+class FakeDocRef:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+class FakeCollection:
+    def __init__(self):
+        self._next_id = 0
+
+    def document(self):
+        self._next_id += 1
+        return FakeDocRef(f"doc{self._next_id}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self.writes = []
+
+    def set(self, doc_ref, payload):
+        self.writes.append((doc_ref.id, payload))
+
+    def commit(self, retry=None):
+        return self._db.commit(self)
+
+
+class FakeFirestoreClient:
+    def __init__(self, failures=0, delay=0.0):
+        self._collection = FakeCollection()
+        self._failures = failures
+        self._delay = delay
+        self._lock = threading.Lock()
+        self.batches = []
+        self.commits = 0
+        self.finished = 0
+        self.max_outstanding = 0
+
+    def collection(self, name):
+        return self._collection
+
+    def batch(self):
+        with self._lock:
+            # Every earlier batch has been submitted; count those not yet finished
+            self.max_outstanding = max(self.max_outstanding, len(self.batches) - self.finished)
+            batch = FakeBatch(self)
+            self.batches.append(batch)
+        return batch
+
+    def commit(self, batch):
+        time.sleep(self._delay)
+        with self._lock:
+            self.commits += 1
+            if self._failures:
+                self._failures -= 1
+                raise RuntimeError("commit failed")
+            self.finished += 1
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self._bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self._bucket.names
+
+    def upload_from_string(self, content, content_type=None):
+        if self.name in self._bucket.failing:
+            raise RuntimeError("upload failed")
+        self._bucket.uploaded.append(self.name)
+
+
+class FakeBucket:
+    def __init__(self, names=(), listed=None, failing=()):
+        self.name = "bucket"
+        self.names = set(names)
+        self._listed = list(self.names) if listed is None else listed
+        self.failing = set(failing)
+        self.uploaded = []
+        self.probed = []
+
+    def list_blobs(self, prefix, max_results):
+        return [FakeBlob(self, name) for name in self._listed if name.startswith(prefix)][:max_results]
+
+    def blob(self, name):
+        self.probed.append(name)
+        return FakeBlob(self, name)
+
+
+class FakeFeature(types.SimpleNamespace):
+    Type = types.SimpleNamespace(LABEL_DETECTION=1, TEXT_DETECTION=2, OBJECT_LOCALIZATION=3)
+
+
+def make_image(content):
+    return {"image": content, "ext": "png", "width": 100, "height": 100}
+
+
+@pytest.fixture
+def pdf_processor(monkeypatch):
+    google = types.ModuleType("google")
+    cloud = types.ModuleType("google.cloud")
+    api_core = types.ModuleType("google.api_core")
+    exceptions = types.ModuleType("google.api_core.exceptions")
+    retry = types.ModuleType("google.api_core.retry")
+    vision = types.ModuleType("google.cloud.vision")
+    firestore = types.ModuleType("google.cloud.firestore")
+    fitz = types.ModuleType("fitz")
+    dotenv = types.ModuleType("dotenv")
+
+    exceptions.GoogleAPICallError = type("GoogleAPICallError", (Exception,), {})
+    exceptions.RetryError = type("RetryError", (Exception,), {})
+    retry.Retry = lambda **kwargs: kwargs
+    retry.if_transient_error = lambda error: False
+    vision.Feature = FakeFeature
+    firestore.SERVER_TIMESTAMP = object()
+    fitz.TOOLS = types.SimpleNamespace(store_shrink=lambda percent: None)
+    dotenv.load_dotenv = lambda: None
+    cloud.documentai = types.ModuleType("google.cloud.documentai")
+    cloud.storage = types.ModuleType("google.cloud.storage")
+    cloud.firestore = firestore
+    cloud.vision = vision
+    google.cloud = cloud
+    google.api_core = api_core
+    api_core.exceptions = exceptions
+    api_core.retry = retry
+
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.cloud", cloud)
+    monkeypatch.setitem(sys.modules, "google.api_core", api_core)
+    monkeypatch.setitem(sys.modules, "google.api_core.exceptions", exceptions)
+    monkeypatch.setitem(sys.modules, "google.api_core.retry", retry)
+    monkeypatch.setitem(sys.modules, "fitz", fitz)
+    monkeypatch.setitem(sys.modules, "dotenv", dotenv)
+    monkeypatch.delitem(sys.modules, "pdf_processor", raising=False)
+
+    module = importlib.import_module("pdf_processor")
+    yield module
+    sys.modules.pop("pdf_processor", None)
+
+
+def test_write_documents_batches_and_returns_ids(pdf_processor):
+    db = FakeFirestoreClient()
+    payloads = [{"page": n} for n in range(120)]
+
+    doc_ids = pdf_processor.write_documents(db, "pdf_text", payloads)
+
+    assert doc_ids == [f"doc{n + 1}" for n in range(120)]
+    assert [len(batch.writes) for batch in db.batches if batch.writes] == [50, 50, 20]
+    assert [payload for batch in db.batches for _, payload in batch.writes] == payloads
+
+
+def test_write_documents_retries_failed_commit(pdf_processor):
+    db = FakeFirestoreClient(failures=1)
+
+    doc_ids = pdf_processor.write_documents(db, "pdf_text", [{"page": 1}])
+
+    assert doc_ids == ["doc1"]
+    assert db.commits == 2
+
+
+def test_write_documents_raises_after_last_attempt(pdf_processor):
+    db = FakeFirestoreClient(failures=pdf_processor.FIRESTORE_COMMIT_ATTEMPTS)
+
+    with pytest.raises(RuntimeError, match="commit failed"):
+        pdf_processor.write_documents(db, "pdf_text", [{"page": 1}])
+    assert db.commits == pdf_processor.FIRESTORE_COMMIT_ATTEMPTS
+
+
+def test_write_documents_bounds_commits_in_flight(pdf_processor, monkeypatch):
+    monkeypatch.setattr(pdf_processor, "FIRESTORE_COMMIT_WORKERS", 1)
+    monkeypatch.setattr(pdf_processor, "FIRESTORE_MAX_IN_FLIGHT", 2)
+    db = FakeFirestoreClient(delay=0.01)
+
+    pdf_processor.write_documents(db, "pdf_text", [{"page": n} for n in range(50 * 8)])
+
+    assert db.finished == 8
+    assert db.max_outstanding <= 2
+
+
+def test_batch_images_for_vision_caps_count_and_bytes(pdf_processor, monkeypatch):
+    images = [(0, n, make_image(b"x" * 10)) for n in range(5)]
+
+    monkeypatch.setattr(pdf_processor, "VISION_BATCH_SIZE", 2)
+    assert [len(batch) for batch in pdf_processor.batch_images_for_vision(images)] == [2, 2, 1]
+
+    monkeypatch.setattr(pdf_processor, "VISION_BATCH_SIZE", 16)
+    monkeypatch.setattr(pdf_processor, "VISION_BATCH_MAX_BYTES", 25)
+    assert [len(batch) for batch in pdf_processor.batch_images_for_vision(images)] == [2, 2, 1]
+
+
+def test_batch_images_for_vision_keeps_oversized_image_alone(pdf_processor, monkeypatch):
+    monkeypatch.setattr(pdf_processor, "VISION_BATCH_MAX_BYTES", 25)
+    images = [(0, 0, make_image(b"x" * 10)), (0, 1, make_image(b"x" * 40)), (0, 2, make_image(b"x" * 10))]
+
+    batches = list(pdf_processor.batch_images_for_vision(images))
+
+    assert [[img_index for _, img_index, _ in batch] for batch in batches] == [[0], [1], [2]]
+
+
+def test_describe_image_batch_falls_back_per_image(pdf_processor, monkeypatch):
+    def analyze(image_contents):
+        if len(image_contents) > 1:
+            raise RuntimeError("batch rejected")
+        if image_contents == [b"bad"]:
+            raise RuntimeError("image rejected")
+        return [f"Contains: {image_contents[0].decode()}"]
+
+    monkeypatch.setattr(pdf_processor, "analyze_images_with_vision", analyze)
+    batch = [(0, 0, make_image(b"chart")), (1, 0, make_image(b"bad"))]
+
+    assert pdf_processor.describe_image_batch(batch) == ["Contains: chart", None]
+
+
+def test_get_blob_matches_listing(pdf_processor):
+    bucket = FakeBucket(names=["my_report.pdf"])
+
+    assert pdf_processor.get_blob(bucket, "my report.pdf").name == "my_report.pdf"
+    assert bucket.probed == []
+
+
+def test_get_blob_probes_when_listing_truncated(pdf_processor):
+    filler = [f"my{n:03d}.pdf" for n in range(pdf_processor.BLOB_LOOKUP_MAX_RESULTS)]
+    bucket = FakeBucket(names=filler + ["my_report.pdf"], listed=filler + ["my_report.pdf"])
+
+    assert pdf_processor.get_blob(bucket, "my report.pdf").name == "my_report.pdf"
+    assert bucket.probed
+
+
+def test_get_blob_raises_when_missing(pdf_processor):
+    bucket = FakeBucket(names=["other.pdf"])
+
+    with pytest.raises(FileNotFoundError):
+        pdf_processor.get_blob(bucket, "my report.pdf")
+    assert bucket.probed == []
+
+
+@pytest.mark.parametrize("uri, expected", [
+    ("gs://bucket/output", ("bucket", "output/")),
+    ("gs://bucket/output/run/", ("bucket", "output/run/")),
+    ("gs://bucket", ("bucket", "/")),
+])
+def test_split_gcs_uri(pdf_processor, uri, expected):
+    assert pdf_processor.split_gcs_uri(uri) == expected
+
+
+def test_upload_image_copies_reuses_one_upload(pdf_processor):
+    bucket = FakeBucket()
+
+    rows = pdf_processor.upload_image_copies(bucket, "doc.pdf", make_image(b"logo"), [(0, 0), (3, 1)], "Contains: logo")
+
+    assert bucket.uploaded == ["extracted_images/doc.pdf_p0_i0.png"]
+    assert [(row["page"], row["image_index"]) for row in rows] == [(1, 0), (4, 1)]
+    assert {row["image_path"] for row in rows} == {"extracted_images/doc.pdf_p0_i0.png"}
+
+
+def test_upload_image_copies_retries_with_next_copy(pdf_processor):
+    bucket = FakeBucket(failing=["extracted_images/doc.pdf_p0_i0.png"])
+
+    rows = pdf_processor.upload_image_copies(bucket, "doc.pdf", make_image(b"logo"), [(0, 0), (3, 1), (5, 2)], None)
+
+    assert bucket.uploaded == ["extracted_images/doc.pdf_p3_i1.png"]
+    assert [(row["page"], row["image_index"]) for row in rows] == [(1, 0), (4, 1), (6, 2)]
+    assert {row["image_path"] for row in rows} == {"extracted_images/doc.pdf_p3_i1.png"}
+    assert rows[0]["description"] == "Image from doc.pdf on page 4"
+
+
+def test_upload_image_copies_reports_skipped_copies(pdf_processor, capsys):
+    bucket = FakeBucket(failing=["extracted_images/doc.pdf_p0_i0.png", "extracted_images/doc.pdf_p3_i1.png"])
+
+    rows = pdf_processor.upload_image_copies(bucket, "doc.pdf", make_image(b"logo"), [(0, 0), (3, 1)], None)
+
+    assert rows == []
+    assert "Skipped every copy of a repeated image: image 0 on page 0, image 1 on page 3" in capsys.readouterr().out
@@ -0,0 +1,179 @@
+import importlib
+import re
+import sqlite3
+import sys
+import types
+from collections import Counter
+
+import pytest
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def count(self):
+        result = [[types.SimpleNamespace(value=len(self._docs))]]
+        return types.SimpleNamespace(get=lambda: result)
+
+    def stream(self):
+        return iter([FakeSnapshot(doc_id, data) for doc_id, data in self._docs])
+
+
+COLLECTIONS = {
+    "pdf_text": [("t1", {"content": "Quarterly sales revenue grew", "source_file": "report.pdf", "page": 1})],
+    "pdf_images_new": [("i1", {"description": "Contains: chart, revenue", "image_path": "extracted_images/a.png", "source_file": "report.pdf", "page": 2})],
+    "videos": [("v1", {"title": "Revenue walkthrough", "description": "How revenue is reported", "video_url": "https://example.com/v"})],
+}
+
+
+class FakeFirestoreClient:
+    def collection(self, name):
+        return FakeCollection(COLLECTIONS.get(name, []))
+
+
+class FakeStorageClient:
+    def bucket(self, name):
+        return types.SimpleNamespace(exists=lambda: True)
+
+
+@pytest.fixture
+def webhook(monkeypatch, tmp_path):
+    google = types.ModuleType("google")
+    cloud = types.ModuleType("google.cloud")
+    firestore = types.ModuleType("google.cloud.firestore")
+    storage = types.ModuleType("google.cloud.storage")
+    firestore.Client = FakeFirestoreClient
+    storage.Client = FakeStorageClient
+    google.cloud = cloud
+    cloud.firestore = firestore
+    cloud.storage = storage
+
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.cloud", cloud)
+    monkeypatch.setitem(sys.modules, "google.cloud.firestore", firestore)
+    monkeypatch.setitem(sys.modules, "google.cloud.storage", storage)
+    monkeypatch.setenv("FTS_INDEX_PATH", str(tmp_path / "index.db"))
+    monkeypatch.delitem(sys.modules, "webhook", raising=False)
+
+    module = importlib.import_module("webhook")
+    yield module
+    sys.modules.pop("webhook", None)
+
+
+def test_import_populates_caches(webhook):
+    text_cache, image_cache, video_cache = webhook.get_caches()
+
+    assert len(text_cache["entries"]) == 1
+    assert len(image_cache["entries"]) == 1
+    assert len(video_cache) == 1
+
+
+def test_search_uses_loaded_caches(webhook):
+    result = webhook.search_content_with_retry("sales revenue")
+
+    assert result["type"] == "text"
+    assert result["source"] == "report.pdf"
+
+
+def test_retry_decorator_reraises_last_error(webhook, monkeypatch):
+    monkeypatch.setattr(webhook.time, "sleep", lambda seconds: None)
+
+    @webhook.firestore_retry_decorator(max_retries=2)
+    def always_fails():
+        raise ValueError("backend unavailable")
+
+    with pytest.raises(ValueError, match="backend unavailable"):
+        always_fails()
+
+
+def create_index(path, backfilled, rows=()):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE VIRTUAL TABLE pdf_text_fts USING fts5(doc_id UNINDEXED, content)")
+    conn.execute("CREATE TABLE pdf_text_fts_state (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO pdf_text_fts VALUES (?, ?)", rows)
+    if backfilled:
+        conn.execute("INSERT INTO pdf_text_fts_state VALUES ('backfilled_at', '2026-01-01T00:00:00Z')")
+    conn.commit()
+    conn.close()
+
+
+def test_incomplete_index_keeps_text_cache(webhook):
+    create_index(webhook.FTS_INDEX_PATH, backfilled=False)
+    webhook.refresh_caches()
+
+    text_cache, _, _ = webhook.get_caches()
+    assert not text_cache["use_index"]
+    assert len(text_cache["entries"]) == 1
+
+
+def test_index_missing_pages_keeps_text_cache(webhook):
+    create_index(webhook.FTS_INDEX_PATH, backfilled=True)
+    webhook.refresh_caches()
+
+    text_cache, _, _ = webhook.get_caches()
+    assert not text_cache["use_index"]
+    assert len(text_cache["entries"]) == 1
+
+
+def test_backfilled_index_replaces_text_cache(webhook):
+    create_index(webhook.FTS_INDEX_PATH, backfilled=True, rows=[("t1", "Quarterly sales revenue grew")])
+    webhook.refresh_caches()
+
+    text_cache, _, _ = webhook.get_caches()
+    assert text_cache["use_index"]
+    assert text_cache["entries"] == []
+
+
+def test_explicit_video_search_stops_only_on_exact_match(webhook, monkeypatch):
+    videos = webhook.build_video_cache([
+        {"id": "v1", "payload": {"title": "watch title", "description": ""}},
+        {"id": "v2", "payload": {"title": "title watch", "description": ""}},
+    ])
+    monkeypatch.setattr(webhook, "_VIDEO_CACHE", videos)
+
+    results = webhook.search_videos("title watch", stop_at_exact_match=True)
+
+    assert [video["title"] for video in results] == ["watch title", "title watch"]
+
+
+def baseline_score(query, text):
+    """The original per-document calculate_tfidf_score"""
+    query_words = set(re.findall(r'\w+', query.lower()))
+    text_words = re.findall(r'\w+', text.lower())
+    if not query_words or not text_words:
+        return 0.0
+    text_freq = Counter(text_words)
+    base_score = sum(text_freq[word] / len(text_words) for word in query_words if word in text_freq) / len(query_words)
+    exact_match_bonus = 1.0 if query.lower() in text.lower() else 0.0
+    title_match_bonus = 0.5 if "title" in text.lower() and any(word in text.lower() for word in query_words) else 0.0
+    return base_score + exact_match_bonus + title_match_bonus
+
+
+@pytest.mark.parametrize("query", ["invoice", "rev", "revenu", "tit", "sales revenue", "missing"])
+def test_score_corpus_matches_baseline_including_substrings(webhook, query):
+    texts = ["Invoices are due monthly", "Quarterly revenue title page", "sales", "", "Revenue revenue sales"]
+    corpus = webhook.build_corpus(
+        [{"id": idx, "payload": {"content": text}} for idx, text in enumerate(texts)],
+        lambda data: data.get("content", "")
+    )
+
+    scores = {entry["id"]: score for entry, score in webhook.score_corpus(*webhook.tokenize_query(query), corpus)}
+
+    for idx, text in enumerate(texts):
+        assert scores.get(idx, 0.0) == pytest.approx(baseline_score(query, text))
@@ -5,11 +5,18 @@ import time
 import re
 import os
 import datetime
+import threading
 import pandas as pd
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
 from functools import wraps
 from collections import Counter
+from bisect import bisect_right
 from urllib.parse import quote
 import io
+import sqlite3
+from contextlib import closing
 
 app = Flask(__name__)
 logging.basicConfig(
@@ -33,25 +40,146 @@ BASE_URL = "https://pdf-webhook-121762575730.us-central1.run.app"
 VIDEO_THRESHOLD = 0.001  # Lower threshold for videos to prioritize them
 TEXT_THRESHOLD = 0.05
 IMAGE_THRESHOLD = 0.01
+_TOKEN_RE = re.compile(r'\w+')
+# Number of best-scoring text/image entries considered per query
+SEARCH_TOP_K = 10
+# How often the in-memory search caches are reloaded from Firestore
+CACHE_REFRESH_SECONDS = int(os.environ.get("CACHE_REFRESH_SECONDS", 300))
+# SQLite FTS5 index of pdf_text written by pdf_processor; replaces the text cache
+# once `pdf_processor.py --backfill-fts` has marked it complete
+FTS_INDEX_PATH = os.environ.get("FTS_INDEX_PATH")
+FTS_TABLE = "pdf_text_fts"
+FTS_STATE_TABLE = "pdf_text_fts_state"
+
+# In-memory copies of the searchable collections, swapped wholesale on refresh.
+# Text and image caches also carry a sparse term-frequency matrix over their entries.
+_cache_lock = threading.RLock()
+_TEXT_CACHE = {"entries": [], "vectorizer": None, "matrix": None, "joined": "", "starts": [], "use_index": False}
+_IMAGE_CACHE = {"entries": [], "vectorizer": None, "matrix": None, "joined": "", "starts": []}
+_VIDEO_CACHE = []
 
 def firestore_retry_decorator(max_retries=3):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             retries = 0
+            last_error = None
             while retries < max_retries:
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
+                    last_error = e
                     retries += 1
                     sleep_time = min(2 ** retries, 10)
                     logging.warning(f"Retry {retries}/{max_retries} - Sleeping {sleep_time}s: {str(e)}")
                     time.sleep(sleep_time)
             logging.error(f"Max retries reached for {func.__name__}")
-            raise
+            raise last_error
         return wrapper
     return decorator
 
+def load_collection(collection_name, fields=None):
+    collection = db.collection(collection_name)
+    # Project to the fields search actually reads to cut download size
+    query = collection.select(fields) if fields else collection
+    return [
+        {"id": doc.id, "payload": doc.to_dict()}
+        for doc in query.stream()
+    ]
+
+def set_search_text(entry, text):
+    """Store the searchable text of a cache entry and its lowercase form"""
+    entry["text"] = str(text or "")
+    entry["lower"] = entry["text"].lower()
+    return entry
+
+def index_text(entry, text):
+    """Freeze the per-document scoring constants for text onto its cache entry"""
+    set_search_text(entry, text)
+    words = _TOKEN_RE.findall(entry["lower"])
+    entry["counter"] = dict(Counter(words))
+    entry["total"] = len(words)
+    return entry
+
+def build_corpus(entries, get_text):
+    """Fit a term-frequency matrix over the entries, one row per entry"""
+    for entry in entries:
+        set_search_text(entry, get_text(entry["payload"]))
+
+    # All lowercase texts in one string, so substring matches are found with
+    # str.find instead of a Python loop; NUL never occurs in a query word
+    starts = []
+    offset = 0
+    for entry in entries:
+        starts.append(offset)
+        offset += len(entry["lower"]) + 1
+    joined = "\0".join(entry["lower"] for entry in entries)
+
+    # Plain tf normalised by document length, matching calculate_tfidf_score
+    vectorizer = TfidfVectorizer(tokenizer=_TOKEN_RE.findall, token_pattern=None, use_idf=False, norm="l1")
+    try:
+        matrix = vectorizer.fit_transform([entry["lower"] for entry in entries])
+    except ValueError:
+        # No entry contains a single token
+        return {"entries": entries, "vectorizer": None, "matrix": None, "joined": joined, "starts": starts}
+
+    return {"entries": entries, "vectorizer": vectorizer, "matrix": matrix, "joined": joined, "starts": starts}
+
+def build_video_cache(entries):
+    """Precompute each video's searchable title + description and its scoring constants"""
+    for entry in entries:
+        video_data = entry["payload"]
+        entry["title"] = str(video_data.get('title', ''))
+        description = str(video_data.get('description', ''))
+        # Combine title and description for searching
+        index_text(entry, f"{entry['title']} {description}")
+    return entries
+
+# No retry decorator: a failed refresh is logged and retried on the next tick
+def refresh_caches():
+    global _TEXT_CACHE, _IMAGE_CACHE, _VIDEO_CACHE
+
+    # With a complete full-text index the text corpus is searched on disk instead
+    use_index = fts_index_available()
+    text_cache = build_corpus(
+        [] if use_index else load_collection("pdf_text", ["content", "source_file", "page"]),
+        lambda data: data.get("content", "")
+    )
+    text_cache["use_index"] = use_index
+    image_cache = build_corpus(
+        load_collection("pdf_images_new", ["description", "image_path", "source_file", "page"]),
+        lambda data: data.get("description",
+            f"Image from {data.get('source_file', 'unknown document')} page {data.get('page', '')}")
+    )
+    video_cache = build_video_cache(load_collection("videos"))
+
+    with _cache_lock:
+        _TEXT_CACHE = text_cache
+        _IMAGE_CACHE = image_cache
+        _VIDEO_CACHE = video_cache
+
+    logging.info(f"Refreshed search caches: {len(text_cache['entries'])} text, {len(image_cache['entries'])} images, {len(video_cache)} videos")
+
+def get_caches():
+    with _cache_lock:
+        return _TEXT_CACHE, _IMAGE_CACHE, _VIDEO_CACHE
+
+def cache_refresh_loop():
+    while True:
+        time.sleep(CACHE_REFRESH_SECONDS)
+        try:
+            refresh_caches()
+        except Exception as e:
+            logging.error(f"Cache refresh failed: {str(e)}")
+
+def start_cache_refresh():
+    try:
+        refresh_caches()
+    except Exception as e:
+        logging.error(f"Initial cache load failed: {str(e)}")
+
+    threading.Thread(target=cache_refresh_loop, name="cache-refresh", daemon=True).start()
+
 @app.route('/health', methods=['GET'])
 def health():
     try:
@@ -62,25 +190,25 @@ def health():
         logging.error(f"Health check failed: {str(e)}")
         return "Service Unhealthy", 500, {'Content-Type': 'text/plain'}
 
-def calculate_tfidf_score(query, text):
+def tokenize_query(query):
+    query_lower = query.lower()
+    return set(_TOKEN_RE.findall(query_lower)), query_lower
+
+def calculate_tfidf_score(query_words, query_lower, entry):
     try:
-        if not query or not text:
-            return 0.0
-            
-        query_words = set(re.findall(r'\w+', query.lower()))
-        text_words = re.findall(r'\w+', text.lower())
-        if not query_words or not text_words:
+        if not query_words or not entry["total"]:
             return 0.0
 
-        text_freq = Counter(text_words)
-        total_words = len(text_words)
-        base_score = sum(text_freq[word]/total_words for word in query_words if word in text_freq) / len(query_words)
+        counter = entry["counter"]
+        total_words = entry["total"]
+        text_lower = entry["lower"]
+        base_score = sum(counter.get(word, 0) for word in query_words) / total_words / len(query_words)
         
         # Boost exact matches
-        exact_match_bonus = 1.0 if query.lower() in text.lower() else 0.0
+        exact_match_bonus = 1.0 if query_lower in text_lower else 0.0
         
         # Boost title matches for videos
-        title_match_bonus = 0.5 if "title" in text.lower() and any(word in text.lower() for word in query_words) else 0.0
+        title_match_bonus = 0.5 if "title" in text_lower and any(word in text_lower for word in query_words) else 0.0
         
         final_score = base_score + exact_match_bonus + title_match_bonus
         return final_score
@@ -89,6 +217,122 @@ def calculate_tfidf_score(query, text):
         logging.error(f"Error calculating score: {str(e)}")
         return 0.0
 
+def substring_candidates(corpus, query_words):
+    """Indices of the entries containing any query word as a substring"""
+    joined = corpus["joined"]
+    starts = corpus["starts"]
+
+    found = set()
+    for word in query_words:
+        pos = joined.find(word)
+        while pos != -1:
+            idx = bisect_right(starts, pos) - 1
+            found.add(idx)
+            if idx + 1 >= len(starts):
+                break
+            # One hit per entry is enough; resume at the next entry
+            pos = joined.find(word, starts[idx + 1])
+    return found
+
+def score_corpus(query_words, query_lower, corpus):
+    """Score the corpus with one sparse matrix-vector product and return the top entries"""
+    vectorizer = corpus["vectorizer"]
+    if vectorizer is None or not query_words:
+        return []
+
+    # As in calculate_tfidf_score, the bonuses match substrings, so any entry
+    # containing a query word as a substring is a candidate. That includes
+    # every entry with a whole-token hit.
+    candidates = np.fromiter(sorted(substring_candidates(corpus, query_words)), dtype=np.intp)
+    if not len(candidates):
+        return []
+
+    vocabulary = vectorizer.vocabulary_
+    columns = [vocabulary[word] for word in query_words if word in vocabulary]
+    if columns:
+        query_vector = csr_matrix(
+            (np.full(len(columns), 1.0 / len(query_words)), ([0] * len(columns), columns)),
+            shape=(1, len(vocabulary))
+        )
+        scores = (corpus["matrix"] @ query_vector.T).toarray().ravel()
+    else:
+        scores = np.zeros(len(corpus["entries"]))
+
+    for idx in candidates:
+        lower = corpus["entries"][idx]["lower"]
+        if query_lower in lower:
+            scores[idx] += 1.0
+        # Every candidate contains a query word, so only "title" needs checking
+        if "title" in lower:
+            scores[idx] += 0.5
+
+    if len(candidates) > SEARCH_TOP_K:
+        top = np.argpartition(-scores[candidates], SEARCH_TOP_K)[:SEARCH_TOP_K]
+        candidates = candidates[top]
+
+    return [(corpus["entries"][idx], float(scores[idx])) for idx in candidates]
+
+def fts_index_available():
+    """True only for an FTS5 index that has been backfilled from all of pdf_text"""
+    if not FTS_INDEX_PATH or not os.path.exists(FTS_INDEX_PATH):
+        return False
+
+    try:
+        with closing(sqlite3.connect(f"file:{FTS_INDEX_PATH}?mode=ro", uri=True)) as conn:
+            backfilled = conn.execute(
+                f"SELECT value FROM {FTS_STATE_TABLE} WHERE key = 'backfilled_at'"
+            ).fetchone()
+            indexed_pages = conn.execute(f"SELECT count(*) FROM {FTS_TABLE}").fetchone()[0]
+    except sqlite3.Error as e:
+        logging.warning(f"Cannot read FTS index {FTS_INDEX_PATH}, keeping the text cache: {str(e)}")
+        return False
+
+    if backfilled is None:
+        logging.warning(f"FTS index {FTS_INDEX_PATH} has not been backfilled, keeping the text cache")
+        return False
+
+    # Pages ingested without FTS_INDEX_PATH reach Firestore only, so compare coverage
+    try:
+        stored_pages = db.collection("pdf_text").count().get()[0][0].value
+    except Exception as e:
+        logging.warning(f"Cannot count pdf_text documents, keeping the text cache: {str(e)}")
+        return False
+
+    if indexed_pages < stored_pages:
+        logging.warning(f"FTS index {FTS_INDEX_PATH} covers {indexed_pages} of {stored_pages} pages, keeping the text cache; re-run --backfill-fts")
+        return False
+    return True
+
+def search_text_index(query_words, query_lower):
+    """Rank pages with the FTS5 index, then fetch and score only the top rows"""
+    if not query_words:
+        return []
+
+    # Quote each token so query text is never parsed as FTS5 syntax
+    match = " OR ".join(f'"{word}"' for word in query_words)
+    with closing(sqlite3.connect(f"file:{FTS_INDEX_PATH}?mode=ro", uri=True)) as conn:
+        rows = conn.execute(
+            f"SELECT doc_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY bm25({FTS_TABLE}) LIMIT ?",
+            (match, SEARCH_TOP_K)
+        ).fetchall()
+    if not rows:
+        return []
+
+    text_collection = db.collection("pdf_text")
+    snapshots = db.get_all(
+        [text_collection.document(doc_id) for (doc_id,) in rows],
+        field_paths=["content", "source_file", "page"]
+    )
+
+    scored = []
+    for snapshot in snapshots:
+        if not snapshot.exists:
+            continue
+        entry = {"id": snapshot.id, "payload": snapshot.to_dict()}
+        index_text(entry, entry["payload"].get("content", ""))
+        scored.append((entry, calculate_tfidf_score(query_words, query_lower, entry)))
+    return scored
+
 def get_public_url(image_path):
     try:
         if not image_path:
@@ -105,27 +349,27 @@ def get_public_url(image_path):
         logging.error(f"Error generating public URL: {str(e)}")
         return None
 
-def search_videos(query):
+def search_videos(query, stop_at_exact_match=False):
     try:
         logging.info("=== Starting Video Search ===")
         logging.info(f"Searching videos for query: {query}")
         
-        # Query the videos collection from Firestore
-        videos_ref = db.collection("videos")
-        videos_docs = videos_ref.stream()
+        query_words, query_lower = tokenize_query(query)
+        _, _, video_cache = get_caches()
         
         results = []
-        for doc in videos_docs:
+        for entry in video_cache:
             try:
-                video_data = doc.to_dict()
-                
-                # Combine title and description for searching
-                title = str(video_data.get('title', ''))
-                description = str(video_data.get('description', ''))
-                searchable_text = f"{title} {description}"
+                # A video sharing no substring with any query word cannot score
+                if not any(word in entry["lower"] for word in query_words):
+                    continue
+
+                # Copy so scoring fields never leak into the shared cache
+                video_data = dict(entry["payload"])
+                title = entry["title"]
                 
                 # Calculate relevance score
-                score = calculate_tfidf_score(query, searchable_text)
+                score = calculate_tfidf_score(query_words, query_lower, entry)
                 
                 # Log each video's score for debugging
                 logging.info(f"Video: '{title}' - Score: {score}")
@@ -135,6 +379,11 @@ def search_videos(query):
                     video_data['type'] = 'video'
                     results.append(video_data)
                     logging.info(f"Added video to results: {title}")
+
+                    # Stop on the exact-match condition itself; base plus title bonus can also reach 1.0
+                    if stop_at_exact_match and query_lower in entry["lower"]:
+                        logging.info(f"Exact match found, stopping video search: {title}")
+                        break
             except Exception as e:
                 logging.error(f"Error processing video document: {str(e)}")
                 continue
@@ -149,14 +398,15 @@ def search_videos(query):
 @firestore_retry_decorator(max_retries=3)
 def search_content_with_retry(query):
     results = []
+    query_words, query_lower = tokenize_query(query)
     
     # Check if this is explicitly a video request
-    is_video_request = any(word in query.lower() for word in ['video', 'watch', 'play', 'show video'])
+    is_video_request = any(word in query_lower for word in ['video', 'watch', 'play', 'show video'])
     logging.info(f"Is video request: {is_video_request}")
     
     # For video requests, prioritize video results
     if is_video_request:
-        video_results = search_videos(query)
+        video_results = search_videos(query, stop_at_exact_match=True)
         logging.info(f"Found {len(video_results)} video results for explicit video request")
         
         if video_results:
@@ -166,16 +416,20 @@ def search_content_with_retry(query):
             return best_video
     
     # If not a video request or no videos found for video request, search other content
+    text_cache, image_cache, _ = get_caches()
+
     try:
-        text_docs = db.collection("pdf_text").stream()
-        for doc in text_docs:
-            data = doc.to_dict()
-            content = data.get("content", "")
-            score = calculate_tfidf_score(query, content)
+        if text_cache["use_index"]:
+            text_matches = search_text_index(query_words, query_lower)
+        else:
+            text_matches = score_corpus(query_words, query_lower, text_cache)
+
+        for entry, score in text_matches:
+            data = entry["payload"]
 
             if score > TEXT_THRESHOLD:
                 results.append({
-                    "content": content,
+                    "content": entry["text"],
                     "source": data.get("source_file", "Unknown"),
                     "page": data.get("page", "N/A"),
                     "score": score,
@@ -185,33 +439,30 @@ def search_content_with_retry(query):
         logging.error(f"Text search failed: {str(e)}")
 
     try:
-        image_docs = db.collection("pdf_images_new").stream()
-        for doc in image_docs:
-            data = doc.to_dict()
+        for entry, score in score_corpus(query_words, query_lower, image_cache):
+            if score <= IMAGE_THRESHOLD:
+                continue
+
+            data = entry["payload"]
             
             image_path = data.get("image_path", "")
             if not image_path:
-                logging.warning(f"No image path for document {doc.id}")
+                logging.warning(f"No image path for document {entry['id']}")
                 continue
                 
             image_url = get_public_url(image_path)
             if not image_url:
                 logging.warning(f"Could not generate URL for image: {image_path}")
                 continue
-                
-            description = data.get("description", 
-                f"Image from {data.get('source_file', 'unknown document')} page {data.get('page', '')}")
-            score = calculate_tfidf_score(query, description)
 
-            if score > IMAGE_THRESHOLD:
-                results.append({
-                    "image_url": image_url,
-                    "description": description,
-                    "source": data.get("source_file", "Unknown"),
-                    "page": data.get("page", "N/A"),
-                    "score": score,
-                    "type": "image"
-                })
+            results.append({
+                "image_url": image_url,
+                "description": entry["text"],
+                "source": data.get("source_file", "Unknown"),
+                "page": data.get("page", "N/A"),
+                "score": score,
+                "type": "image"
+            })
     except Exception as e:
         logging.error(f"Image search failed: {str(e)}")
     
@@ -267,7 +518,7 @@ def webhook():
         # Force video search for explicit video requests
         if any(word in query.lower() for word in ['video', 'watch', 'play', 'show video']):
             logging.info("Explicit video request detected, forcing video search")
-            video_results = search_videos(query)
+            video_results = search_videos(query, stop_at_exact_match=True)
             if video_results:
                 best_video = max(video_results, key=lambda x: x["score"])
                 logging.info(f"Forcing video result: {best_video['title']}")
@@ -408,5 +659,8 @@ def error_response(message, status_code=400):
         }
     }), status_code
 
+# Load the caches only once every search helper above is defined
+start_cache_refresh()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), debug=True)